@@ -2,16 +2,21 @@ import asyncio
 import logging
 import json
 import os
+import secrets
 import shutil
+import uuid
 import yaml
 
-from fastapi import FastAPI, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Depends, Form, Header, HTTPException
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.responses import StreamingResponse
 
+from autotune_code import autotune_service
 from logger_code import LoggerBase
-from pydantic_models import AudioProcessRequest, as_form, global_state
+from profiling_code import job_profile_dir, job_profiler
+from pydantic_models import AudioProcessRequest, as_form, global_state, AUDIO_QUALITY_MAP
+from slo_policy_code import slo_policy_service
 from transcribe_code import transcribe_mp3
 from metadata_code import MetadataService
 from youtube_download_code import YouTubeDownloader
@@ -31,10 +36,49 @@ logger = LoggerBase.setup_logger("fastapi-transcriber-endpoint", level=logging.D
 
 metadata_service = MetadataService()
 
+@app.on_event("startup")
+async def autotune_on_startup():
+    # e.g. AUTOTUNE_ON_STARTUP=tiny,large calibrates those models in the background when the service starts.
+    audio_qualities = [q.strip() for q in os.getenv("AUTOTUNE_ON_STARTUP", "").split(",") if q.strip()]
+    if audio_qualities:
+        loop = asyncio.get_running_loop()
+        calibration = loop.run_in_executor(None, autotune_service.calibrate_qualities, audio_qualities, "default", logger)
+        # Nothing awaits the calibration, so report failures here or they are lost.
+        calibration.add_done_callback(log_autotune_failure)
+
+def log_autotune_failure(calibration: asyncio.Future) -> None:
+    if not calibration.cancelled() and calibration.exception():
+        logger.error(f"app.autotune_on_startup: Calibration failed: {calibration.exception()}")
+
+def require_admin(x_admin_token: str) -> None:
+    # Admin features are off unless ADMIN_TOKEN is set.
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token or not x_admin_token or not secrets.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required.")
+
 @app.post("/api/v1/process_audio")
-async def process_audio(audio_input: AudioProcessRequest = Depends(as_form)):
+async def process_audio(audio_input: AudioProcessRequest = Depends(as_form), x_admin_token: str = Header(None)):
+    if audio_input.profile:
+        require_admin(x_admin_token)
     global_state.reset()
-    global_state.update(audio_quality=audio_input.audio_quality)
+    if audio_input.audio_quality not in AUDIO_QUALITY_MAP:
+        # e.g. large-assisted when ENABLE_ASSISTED_DECODING isn't on.
+        raise HTTPException(status_code=400, detail=f"Unknown audio quality '{audio_input.audio_quality}'. Choose from {list(AUDIO_QUALITY_MAP)}.")
+    if audio_input.start_time is not None and audio_input.end_time is not None and audio_input.start_time >= audio_input.end_time:
+        raise HTTPException(status_code=400, detail="start_time must be before end_time.")
+    # Catch bad overrides now rather than in the pipeline after the download.
+    for name in ("chunk_length_s", "batch_size"):
+        value = getattr(audio_input, name)
+        if value is not None and value <= 0:
+            raise HTTPException(status_code=400, detail=f"{name} must be greater than 0.")
+    global_state.update(audio_quality=audio_input.audio_quality, chapter_selection=audio_input.chapter_selection,
+                        start_time=audio_input.start_time, end_time=audio_input.end_time,
+                        chunk_length_s=audio_input.chunk_length_s, batch_size=audio_input.batch_size,
+                        job_id=uuid.uuid4().hex)
+    if audio_input.profile:
+        job_profiler.start(global_state.job_id)
+    else:
+        job_profiler.reset()
     logger.debug("app.process_audio: Starting init_audio")
     # Processing moves to the event stream.
     if YouTubeDownloader.is_youtube_url(audio_input):
@@ -43,7 +87,7 @@ async def process_audio(audio_input: AudioProcessRequest = Depends(as_form)):
         file_path = prep_file_for_transcription(audio_input.file)
         global_state.update(mp3_filepath=file_path, isYouTube_url=False)
     # Return a success message
-    return JSONResponse(content={"message": "Audio processing started successfully"}, status_code=200)
+    return JSONResponse(content={"message": "Audio processing started successfully", "job_id": global_state.job_id}, status_code=200)
 
 def prep_file_for_transcription(obsidian_file) -> str:
     '''prepare the file for transcription
@@ -63,22 +107,85 @@ async def stream():
     return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 async def event_stream():
-    # The mp3 file can come from a YouTube video or an mp3 file.
+    try:
+        async for event in job_event_stream():
+            yield event
+    finally:
+        # Write the profile even if the job failed part way through. That is often when it is wanted.
+        profile_dir = job_profiler.save()
+        if profile_dir:
+            logger.info(f"app.event_stream: Profile for job {global_state.job_id} saved to {profile_dir}")
+
+async def job_event_stream():
+    # Metadata first. It has the audio duration, which decides whether (and with which model) the job
+    # is taken before anything is downloaded or transcribed.
+    downloader = None
+    try:
+        if global_state.isYouTube_url:
+            downloader = YouTubeDownloader(global_state.youtube_url, logger)
+            downloader.extract_metadata()
+        else:
+            global_state.yaml_metadata = metadata_service.extract_mp3_metadata(global_state.mp3_filepath)
+        status = apply_slo_policy()
+        if status:
+            yield f"data: {json.dumps({'status': status})}\n\n"
+    except Exception as e:
+        # Either the chapter selection or time range doesn't fit the audio, or the job was rejected.
+        yield f"data: {json.dumps({'error': str(e.args[0])})}\n\n"
+        remove_temp_mp3_files()
+        return
+    slo_ticket = slo_policy_service.start_job(global_state.audio_quality, global_state.compute_type,
+                                              global_state.audio_duration, num_chapters_to_transcribe())
+    try:
+        async for event in download_and_transcribe(downloader, slo_ticket):
+            yield event
+    finally:
+        slo_policy_service.finish_job(slo_ticket)
+
+def apply_slo_policy() -> str:
+    '''Switch to a smaller tier if the service is too busy to meet the SLO. Returns a status message if it did.'''
+    requested_audio_quality = global_state.audio_quality
+    audio_quality = slo_policy_service.choose_audio_quality(requested_audio_quality, global_state.compute_type,
+                                                            global_state.audio_duration, logger, num_chapters_to_transcribe())
+    # large and large-assisted share a model, so record the tier as well as the model.
+    global_state.yaml_metadata["audio quality tier"] = audio_quality
+    if audio_quality == requested_audio_quality:
+        return None
+    global_state.update(audio_quality=audio_quality)
+    global_state.yaml_metadata["audio quality"] = AUDIO_QUALITY_MAP.get(audio_quality, '')
+    global_state.yaml_metadata["requested audio quality tier"] = requested_audio_quality
+    return f'The service is busy. Transcribing with {audio_quality} instead of {requested_audio_quality}.'
+
+def num_chapters_to_transcribe() -> int:
+    # With no chapters transcribe_mp3 transcribes the whole file as one.
+    return max(len(global_state.chapters), 1)
+
+def remove_temp_mp3_files() -> None:
+    # A ranged download has one mp3 per section.
+    mp3_filepaths = {global_state.mp3_filepath} | {chapter['mp3_filepath'] for chapter in global_state.chapters if 'mp3_filepath' in chapter}
+    for mp3_filepath in mp3_filepaths:
+        if mp3_filepath and os.path.exists(mp3_filepath):
+            os.remove(mp3_filepath)
+
+async def download_and_transcribe(downloader: YouTubeDownloader = None, slo_ticket: int = None):
     # IF the mp3 file comes from a YouTube video, we must download the mp3 file.
-    if global_state.isYouTube_url:
-        # Get the mp3 file and metadata. Once we have the mp3 file, it can be transcribed.
+    if downloader:
+        # Get the mp3 file. Once we have the mp3 file, it can be transcribed.
         try:
-            downloader = YouTubeDownloader(global_state.youtube_url, logger)  # Pass the loop to the downloader.
             async for event in downloader.download_youtube_to_mp3():
                 logger.debug(f"app.event_stream: Yielding event: {event}")
                 yield f"data: {json.dumps(event)}\n\n"
             # Update global_state.mp3_filepath after download completes
-            global_state.update(mp3_filepath=f"{downloader.base_temp_mp3_filepath}.mp3")
+            global_state.update(mp3_filepath=downloader.mp3_filepath)
         except Exception as e:
-            logger.debug(f"app.event_stream: Yielding transcription event: {event}")
+            logger.debug(f"app.event_stream: Yielding error event: {e}")
             yield f"data: {json.dumps({'error': str(e.args[0])})}\n\n"
-    else:
-        global_state.yaml_metadata = metadata_service.extract_mp3_metadata(global_state.mp3_filepath)
+            # Some sections may have finished before the error.
+            for mp3_filepath in downloader.mp3_filepaths.values():
+                if os.path.exists(mp3_filepath):
+                    os.remove(mp3_filepath)
+            # There is no mp3 file to wait on, so there is nothing to transcribe.
+            return
 
     # Once the mp3 file is available, we can move on to transcription. The file will be
     # available immediately if the start was a file upload.
@@ -87,8 +194,17 @@ async def event_stream():
 
     # Now we are on to transcription.
     try:
+        num_chapters = num_chapters_to_transcribe()
+        chapters_done = 0
         async for event in transcribe_mp3(global_state.mp3_filepath, logger):
+            if 'chapter' in event and slo_ticket is not None:
+                # Later jobs only wait on the part of this one that is left.
+                chapters_done += 1
+                slo_policy_service.update_job(slo_ticket, global_state.audio_duration - global_state.transcribed_seconds,
+                                              num_chapters - chapters_done)
             if 'done' in event:
+                slo_policy_service.record_realtime_factor(global_state.audio_quality, global_state.audio_duration, global_state.inference_time)
+                slo_policy_service.record_load_seconds(global_state.audio_quality, global_state.model_load_time, num_chapters)
                 # Serialize data to a YAML string
                 global_state.update(transcription_time=event['done'])
                 yaml_string = yaml.dump(global_state.yaml_metadata)
@@ -97,15 +213,43 @@ async def event_stream():
                 yield f"data: {json.dumps({'basefilename':global_state.basefilename})}\n\n"
                 yield f"data: {json.dumps({'frontmatter': frontmatter})}\n\n"
                 yield f"data: {json.dumps({'done':'Finished Transcription.'})}\n\n"
-                # Delete the mp3 file.
-                if os.path.exists(global_state.mp3_filepath):
-                    os.remove(global_state.mp3_filepath)
+                remove_temp_mp3_files()
             else:
                 yield f"data: {json.dumps(event)}\n\n"
     except Exception as e:
         yield f"data: {json.dumps({'error': str(e.args[0])})}\n\n"
 
 
+@app.post("/api/v1/autotune")
+async def autotune(audio_quality: str = Form(default="default", description="Comma separated audio qualities to calibrate."),
+                   compute_type: str = Form(default="default"), x_admin_token: str = Header(None)):
+    # Calibration ties up the host for minutes and overwrites the tuned settings.
+    require_admin(x_admin_token)
+    audio_qualities = [q.strip() for q in audio_quality.split(",") if q.strip()]
+    loop = asyncio.get_running_loop()
+    try:
+        # Calibration runs the models for minutes, so keep it off of the event loop.
+        results = await loop.run_in_executor(None, autotune_service.calibrate_qualities, audio_qualities, compute_type, logger)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(content=results, status_code=200)
+
+@app.get("/api/v1/profiles/{job_id}")
+async def list_profile(job_id: str, x_admin_token: str = Header(None)):
+    require_admin(x_admin_token)
+    job_dir = job_profile_dir(job_id)
+    if not os.path.isdir(job_dir):
+        raise HTTPException(status_code=404, detail=f"No profile for job {job_id}.")
+    return {"job_id": job_id, "artifacts": sorted(os.listdir(job_dir))}
+
+@app.get("/api/v1/profiles/{job_id}/{artifact}")
+async def get_profile_artifact(job_id: str, artifact: str, x_admin_token: str = Header(None)):
+    require_admin(x_admin_token)
+    artifact_path = os.path.join(job_profile_dir(job_id), os.path.basename(artifact))
+    if not os.path.isfile(artifact_path):
+        raise HTTPException(status_code=404, detail=f"No artifact {artifact} for job {job_id}.")
+    return FileResponse(artifact_path)
+
 @app.get("/api/v1/health")
 async def health_check():
     return {"status": "ok"}
@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from pydub import AudioSegment
+import numpy as np
+import psutil
+import torch
+
+from logger_code import LoggerBase
+from pydantic_models import AUDIO_QUALITY_MAP, COMPUTE_TYPE_MAP
+
+DEFAULT_CHUNK_LENGTH_S = 30
+DEFAULT_BATCH_SIZE = 8
+CANDIDATE_CHUNK_LENGTHS = [15, 30]
+CANDIDATE_BATCH_SIZES = [1, 2, 4, 8, 16]
+WHISPER_SAMPLING_RATE = 16000
+
+
+class AutoTuneService:
+    '''Find and remember the fastest chunk_length_s/batch_size for each model on this host.
+
+    A calibration runs the ASR pipeline over a short speech clip (AUTOTUNE_AUDIO_FILEPATH) for every
+    candidate chunk length and batch size.  It measures throughput (seconds of audio transcribed per
+    wall clock second) and peak memory (the most memory the call used on top of what was in use when
+    it started, i.e. activations and buffers but not the model weights).  The winners are written to
+    a JSON file keyed by host, model and dtype so they survive restarts and are picked up by
+    transcribe_mp3.
+    '''
+    def __init__(self, settings_filepath: str = None, calibration_audio_filepath: str = None,
+                 calibration_seconds: int = 120, max_memory_mb: Optional[float] = None):
+        self.settings_filepath = settings_filepath or os.getenv("AUTOTUNE_SETTINGS_FILEPATH", "autotune.json")
+        self.calibration_audio_filepath = calibration_audio_filepath or os.getenv("AUTOTUNE_AUDIO_FILEPATH")
+        self.calibration_seconds = calibration_seconds
+        max_memory_mb = max_memory_mb or os.getenv("AUTOTUNE_MAX_MEMORY_MB")
+        # Candidates whose peak_memory_mb is above this are not considered, even if they are the fastest.
+        self.max_memory_mb = float(max_memory_mb) if max_memory_mb else None
+        self.settings = self.load_settings()
+
+    def host_key(self) -> str:
+        # The best batch size depends on the hardware, not the machine name (which changes per container).
+        if torch.cuda.is_available():
+            return f"cuda:{torch.cuda.get_device_name(0)}"
+        # torch sizes its thread pool to the CPUs this process may run on (or to OMP_NUM_THREADS), which
+        # in a container can be far fewer than the host's os.cpu_count().
+        return f"cpu:{torch.get_num_threads()}"
+
+    def settings_key(self, hf_model_name: str, compute_type_pytorch: torch.dtype) -> str:
+        return f"{self.host_key()}|{hf_model_name}|{compute_type_pytorch}"
+
+    def load_settings(self) -> Dict[str, dict]:
+        if not os.path.exists(self.settings_filepath):
+            return {}
+        with open(self.settings_filepath, "r") as f:
+            return json.load(f)
+
+    def save_settings(self) -> None:
+        with open(self.settings_filepath, "w") as f:
+            json.dump(self.settings, f, indent=2)
+
+    def get_settings(self, hf_model_name: str, compute_type_pytorch: torch.dtype) -> Tuple[int, int]:
+        '''Return (chunk_length_s, batch_size) for the model, falling back to the defaults if it was never tuned.'''
+        tuned = self.settings.get(self.settings_key(hf_model_name, compute_type_pytorch))
+        if not tuned:
+            return DEFAULT_CHUNK_LENGTH_S, DEFAULT_BATCH_SIZE
+        return tuned["chunk_length_s"], tuned["batch_size"]
+
+    def check_calibration_audio(self) -> None:
+        # Whisper emits next to no tokens for silence or noise, which would make every model look far
+        # faster than it is.  The SLO policy relies on these throughputs, so only real speech will do.
+        if not self.calibration_audio_filepath:
+            raise ValueError("Set AUTOTUNE_AUDIO_FILEPATH to a speech clip to calibrate with.")
+        if not os.path.exists(self.calibration_audio_filepath):
+            raise ValueError(f"The calibration clip {self.calibration_audio_filepath} does not exist.")
+
+    def load_calibration_audio(self) -> dict:
+        self.check_calibration_audio()
+        audio = AudioSegment.from_file(self.calibration_audio_filepath)[:self.calibration_seconds * 1000]
+        audio = audio.set_channels(1).set_frame_rate(WHISPER_SAMPLING_RATE).set_sample_width(2)
+        raw = np.array(audio.get_array_of_samples(), dtype=np.float32) / 32768.0
+        return {"raw": raw, "sampling_rate": WHISPER_SAMPLING_RATE}
+
+    def measure(self, transcriber, audio: dict, chunk_length_s: int, batch_size: int) -> dict:
+        start_time = time.time()
+        # The pipeline pops keys off of the input dict, so hand it a copy.
+        with PeakMemory() as peak_memory:
+            transcriber(dict(audio), chunk_length_s=chunk_length_s, batch_size=batch_size)
+        elapsed = time.time() - start_time
+        audio_seconds = len(audio["raw"]) / audio["sampling_rate"]
+        return {
+            "chunk_length_s": chunk_length_s,
+            "batch_size": batch_size,
+            "throughput": round(audio_seconds / elapsed, 2),
+            "peak_memory_mb": round(peak_memory.peak_mb, 1),
+        }
+
+    def calibrate(self, hf_model_name: str, compute_type_pytorch: torch.dtype, logger: LoggerBase,
+                  chunk_lengths: List[int] = None, batch_sizes: List[int] = None) -> dict:
+        '''Measure every candidate for the model, persist the fastest and return it.'''
+        # Imported here to avoid a circular import; transcribe_code asks this module for its settings.
+        from transcribe_code import load_transcriber
+        transcriber = load_transcriber(hf_model_name, compute_type_pytorch)
+        audio = self.load_calibration_audio()
+        # The first call pays for one-time setup, which would unfairly penalize whichever candidate ran first.
+        transcriber(dict(audio), chunk_length_s=DEFAULT_CHUNK_LENGTH_S, batch_size=1)
+        results = []
+        for chunk_length_s in chunk_lengths or CANDIDATE_CHUNK_LENGTHS:
+            for batch_size in batch_sizes or CANDIDATE_BATCH_SIZES:
+                try:
+                    result = self.measure(transcriber, audio, chunk_length_s, batch_size)
+                except RuntimeError as e:
+                    # Most likely out of memory. Larger batches for this chunk length will fail too.
+                    logger.warning(f"autotune_code.calibrate: {hf_model_name} failed at chunk_length_s={chunk_length_s}, batch_size={batch_size}: {e}")
+                    break
+                logger.debug(f"autotune_code.calibrate: {hf_model_name} {result}")
+                results.append(result)
+        candidates = [r for r in results if self.max_memory_mb is None or r["peak_memory_mb"] <= self.max_memory_mb]
+        if not candidates:
+            raise Exception(f"No chunk length/batch size for {hf_model_name} ran within {self.max_memory_mb} MB.")
+        best = max(candidates, key=lambda r: r["throughput"])
+        self.settings[self.settings_key(hf_model_name, compute_type_pytorch)] = best
+        self.save_settings()
+        logger.info(f"autotune_code.calibrate: {hf_model_name} ({compute_type_pytorch}) will use {best}")
+        return best
+
+    def calibrate_qualities(self, audio_qualities: List[str], compute_type: str, logger: LoggerBase) -> Dict[str, dict]:
+        '''Calibrate the models behind the given AUDIO_QUALITY_MAP keys. Models shared by several keys are only tuned once.'''
+        # Fail before spending minutes loading models.
+        self.check_calibration_audio()
+        unknown = [audio_quality for audio_quality in audio_qualities if audio_quality not in AUDIO_QUALITY_MAP]
+        if unknown:
+            raise ValueError(f"Unknown audio quality {unknown}. Choose from {list(AUDIO_QUALITY_MAP)}.")
+        compute_type_pytorch = COMPUTE_TYPE_MAP.get(compute_type, COMPUTE_TYPE_MAP["default"])
+        results = {}
+        for audio_quality in audio_qualities:
+            hf_model_name = AUDIO_QUALITY_MAP[audio_quality]
+            if hf_model_name not in results:
+                results[hf_model_name] = self.calibrate(hf_model_name, compute_type_pytorch, logger)
+        return results
+
+class PeakMemory:
+    '''Context manager that measures the most memory used inside it beyond what was in use on entry.
+
+    On CUDA this is the allocator's peak.  On CPU the process RSS is sampled from a background thread
+    since there is no peak counter that can be reset.  Either way peak_mb excludes whatever (e.g. the
+    model weights) was already loaded, so the numbers mean the same thing on every device.
+    '''
+    def __init__(self, sample_interval_s: float = 0.01):
+        self.sample_interval_s = sample_interval_s
+        self.peak_mb = 0.0
+
+    def __enter__(self):
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+            self.baseline = torch.cuda.memory_allocated()
+        else:
+            self.process = psutil.Process()
+            self.baseline = self.process.memory_info().rss
+            self.peak = self.baseline
+            self.stop_sampling = threading.Event()
+            self.sampler = threading.Thread(target=self.sample_rss, daemon=True)
+            self.sampler.start()
+        return self
+
+    def sample_rss(self):
+        while not self.stop_sampling.wait(self.sample_interval_s):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def __exit__(self, *exc_info):
+        if torch.cuda.is_available():
+            peak = torch.cuda.max_memory_allocated()
+        else:
+            self.stop_sampling.set()
+            self.sampler.join()
+            peak = max(self.peak, self.process.memory_info().rss)
+        self.peak_mb = max(peak - self.baseline, 0) / (1024 * 1024)
+        return False
+
+# Instance shared by the app and the transcription code.
+autotune_service = AutoTuneService()
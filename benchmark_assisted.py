@@ -0,0 +1,37 @@
+'''Compare the large-assisted tier against plain large on this host.
+
+Usage: python benchmark_assisted.py <audio file> [--compute_type float32]
+
+Each tier runs the way it does in production: large with the autotuned (or default) chunk_length_s
+and batch_size, large-assisted with the same chunk length and batch_size=1 (the only batch size
+assisted generation supports).  Prints the wall clock time of each and whether the transcripts match.
+'''
+import argparse
+import time
+
+from autotune_code import autotune_service
+from transcribe_code import load_transcriber
+from pydantic_models import ASSISTANT_MODEL_MAP, COMPUTE_TYPE_MAP
+
+LARGE_MODEL = "openai/whisper-large-v3"
+
+def time_transcription(audio_filepath: str, compute_type_pytorch, chunk_length_s: int, batch_size: int, assistant_model_name: str = None):
+    transcriber = load_transcriber(LARGE_MODEL, compute_type_pytorch, assistant_model_name)
+    start_time = time.time()
+    result = transcriber(audio_filepath, chunk_length_s=chunk_length_s, batch_size=batch_size)
+    return result['text'], round(time.time() - start_time, 1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("audio_filepath")
+    # float16 is slow or unsupported for many ops on CPU.
+    parser.add_argument("--compute_type", default="float32", choices=list(COMPUTE_TYPE_MAP))
+    args = parser.parse_args()
+    compute_type_pytorch = COMPUTE_TYPE_MAP[args.compute_type]
+    chunk_length_s, batch_size = autotune_service.get_settings(LARGE_MODEL, compute_type_pytorch)
+
+    large_text, large_time = time_transcription(args.audio_filepath, compute_type_pytorch, chunk_length_s, batch_size)
+    assisted_text, assisted_time = time_transcription(args.audio_filepath, compute_type_pytorch, chunk_length_s, 1, ASSISTANT_MODEL_MAP["large-assisted"])
+    print(f"large (chunk_length_s={chunk_length_s}, batch_size={batch_size}): {large_time} seconds")
+    print(f"large-assisted (chunk_length_s={chunk_length_s}, batch_size=1): {assisted_time} seconds ({large_time / assisted_time:.2f}x)")
+    print(f"Transcripts match: {large_text == assisted_text}")
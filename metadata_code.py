@@ -2,7 +2,7 @@
 import re
 
 from mutagen.mp3 import MP3
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 import yt_dlp
 
 import os
@@ -41,21 +41,110 @@ class MetadataService:
 
             # Chapters are extracted and returned separately because they are used for knowing the
             # transcript part stop and starts, but is not part of the frontmatter.
-            chapters = info_dict.get('chapters', [])
-            global_state.update(yaml_metadata=metadata, chapters=chapters, basefilename=metadata['filename'])
+            chapters = info_dict.get('chapters') or []
+            chapters, sections = self.select_section(chapters, info_dict.get('duration') or 0)
+            self.add_section_metadata(metadata, chapters, sections)
+            audio_duration = self.selected_duration(chapters) if sections else info_dict.get('duration') or 0
+            global_state.update(yaml_metadata=metadata, chapters=chapters, sections=sections, audio_duration=audio_duration, basefilename=metadata['filename'])
 
 
     def extract_mp3_metadata(self, mp3_filepath: str) -> Dict[str, str]:
         audio = MP3(mp3_filepath)
         duration = round(audio.info.length)
         upload_date = datetime.fromtimestamp(os.path.getmtime(mp3_filepath)).strftime('%Y-%m-%d')
-        return {
+        metadata = {
             "duration": self.format_time(duration),
             "upload_date": upload_date,
             "filename": os.path.basename(mp3_filepath),
             "audio quality": AUDIO_QUALITY_MAP.get(global_state.audio_quality, ''),
             "compute type": str(COMPUTE_TYPE_MAP.get(global_state.compute_type, '')),
         }
+        # An uploaded mp3 has no chapters, so only a time range can narrow it down.
+        chapters, sections = self.select_section([], audio.info.length)
+        self.add_section_metadata(metadata, chapters, sections)
+        audio_duration = self.selected_duration(chapters) if sections else audio.info.length
+        global_state.update(chapters=chapters, sections=sections, audio_duration=audio_duration)
+        return metadata
+
+    def select_section(self, chapters: List[dict], duration: float) -> Tuple[List[dict], Optional[List[Tuple[float, float]]]]:
+        '''Narrow the chapters down to what the client asked for.
+
+        Applies global_state.chapter_selection and then clips to global_state.start_time/end_time.
+        Returns the chapters to transcribe and the (start, end) seconds of each contiguous run of them,
+        so chapters "1,5" become two sections rather than everything from 1 to 5.  The sections are
+        None when the whole source is wanted, so the downloader knows it can fetch everything.
+        '''
+        selection, start, end = global_state.chapter_selection, global_state.start_time, global_state.end_time
+        if not selection and start is None and end is None:
+            return chapters, None
+        selected = chapters
+        if selection:
+            if not chapters:
+                raise ValueError("A chapter selection was requested but the audio has no chapters.")
+            selected = [chapters[i] for i in self.parse_chapter_selection(selection, len(chapters))]
+        if start is not None or end is not None:
+            start = start or 0.0
+            if start < 0:
+                raise ValueError(f"start_time can't be negative ({start}).")
+            # A duration of 0 means the source didn't say (e.g. a live stream), so there is nothing to check against.
+            if duration:
+                if start >= duration:
+                    raise ValueError(f"start_time {start} is past the end of the audio ({duration} seconds).")
+                end = min(end, float(duration)) if end is not None else float(duration)
+            elif end is None:
+                raise ValueError("The length of the audio is unknown, so an end_time is needed.")
+            if end <= start:
+                raise ValueError(f"end_time {end} must be after start_time {start}.")
+            if not selected:
+                # No chapters, so the time range becomes the one and only chapter.
+                selected = [{'start_time': start, 'end_time': end, 'title': ''}]
+            else:
+                selected = [dict(chapter, start_time=max(chapter['start_time'], start), end_time=min(chapter['end_time'], end))
+                            for chapter in selected if chapter['end_time'] > start and chapter['start_time'] < end]
+            if not selected:
+                raise ValueError(f"No chapters fall between {start} and {end} seconds.")
+        return selected, self.contiguous_sections(selected)
+
+    def contiguous_sections(self, chapters: List[dict]) -> List[Tuple[float, float]]:
+        '''Merge back to back chapters into (start, end) sections.'''
+        sections = []
+        for chapter in chapters:
+            if sections and chapter['start_time'] <= sections[-1][1]:
+                sections[-1] = (sections[-1][0], max(sections[-1][1], chapter['end_time']))
+            else:
+                sections.append((chapter['start_time'], chapter['end_time']))
+        return sections
+
+    def selected_duration(self, chapters: List[dict]) -> float:
+        return sum(chapter['end_time'] - chapter['start_time'] for chapter in chapters)
+
+    def parse_chapter_selection(self, selection: str, num_chapters: int) -> List[int]:
+        '''Turn a 1-based selection like "2,4-6" into sorted 0-based chapter indices.'''
+        indices = set()
+        for part in selection.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            first, _, last = part.partition('-')
+            try:
+                first, last = int(first), int(last or first)
+            except ValueError:
+                raise ValueError(f"Invalid chapter selection '{selection}'. Use a form like '2,4-6'.")
+            if first < 1 or last > num_chapters or first > last:
+                raise ValueError(f"Chapter selection '{part}' is outside of chapters 1-{num_chapters}.")
+            indices.update(range(first - 1, last))
+        if not indices:
+            raise ValueError(f"Invalid chapter selection '{selection}'. Use a form like '2,4-6'.")
+        return sorted(indices)
+
+    def add_section_metadata(self, metadata: dict, chapters: List[dict], sections: Optional[List[Tuple[float, float]]]) -> None:
+        # Let the frontmatter show that only part of the audio was transcribed.
+        if sections is None:
+            return
+        metadata["transcribed sections"] = [f"{self.format_time(int(start))} - {self.format_time(int(end))}" for start, end in sections]
+        titles = [chapter['title'] for chapter in chapters if chapter.get('title')]
+        if titles:
+            metadata["transcribed chapters"] = titles
 
     def format_time(self, seconds: int) -> str:
         mins, secs = divmod(seconds, 60)
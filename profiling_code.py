@@ -0,0 +1,99 @@
+import cProfile
+import io
+import os
+import pstats
+from contextlib import contextmanager
+from typing import Dict, List
+
+import torch
+
+PROFILES_DIR = os.getenv("PROFILES_DIR", "profiles")
+# Forward passes per inference call recorded by the torch profiler.  A long chapter on a large model
+# runs thousands of them, and recording them all would hold millions of events in memory.
+TORCH_PROFILER_STEPS = int(os.getenv("TORCH_PROFILER_STEPS", "20"))
+
+
+class JobProfiler:
+    '''Profile the stages of one job when an admin asks for it.
+
+    Each stage (download, decode, slice, load_model, inference) gets its own cProfile.Profile.  A stage that runs
+    more than once, e.g. inference for every chapter, adds to the same profile.  Inference also runs
+    under the torch profiler so the time spent in each op is recorded, for the first
+    TORCH_PROFILER_STEPS forward passes of each call.  save() writes everything to
+    PROFILES_DIR/<job id>/.  When profiling is off the context managers do nothing.
+    '''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.enabled = False
+        self.job_id = None
+        self.stage_profiles: Dict[str, cProfile.Profile] = {}
+        self.torch_op_tables: List[str] = []
+
+    def start(self, job_id: str):
+        self.reset()
+        self.enabled = True
+        self.job_id = job_id
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        profile = self.stage_profiles.setdefault(name, cProfile.Profile())
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+
+    @contextmanager
+    def torch_ops(self, name: str, model: torch.nn.Module):
+        if not self.enabled:
+            yield
+            return
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        # Each forward pass of the model (and of its encoder, which generate() calls on its own) is a
+        # profiler step.  After the first one (warmup) the next TORCH_PROFILER_STEPS are recorded.
+        schedule = torch.profiler.schedule(wait=0, warmup=1, active=TORCH_PROFILER_STEPS, repeat=1)
+        with torch.profiler.profile(activities=activities, schedule=schedule) as prof:
+            modules = [model]
+            if hasattr(model, "get_encoder"):
+                modules.append(model.get_encoder())
+            hooks = [module.register_forward_hook(lambda *_: prof.step()) for module in modules]
+            try:
+                yield
+            finally:
+                for hook in hooks:
+                    hook.remove()
+        sort_by = "cuda_time_total" if torch.cuda.is_available() else "cpu_time_total"
+        self.torch_op_tables.append(f"{name}\n{prof.key_averages().table(sort_by=sort_by, row_limit=30)}")
+
+    def save(self) -> str:
+        '''Write the artifacts for the job and return the directory they are in.'''
+        if not self.enabled:
+            return None
+        job_dir = job_profile_dir(self.job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        for name, profile in self.stage_profiles.items():
+            # The .prof file is for snakeviz or pstats.  The .txt file is a quick look at the hot spots.
+            profile.dump_stats(os.path.join(job_dir, f"{name}.prof"))
+            summary = io.StringIO()
+            pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(40)
+            with open(os.path.join(job_dir, f"{name}.txt"), "w") as f:
+                f.write(summary.getvalue())
+        if self.torch_op_tables:
+            with open(os.path.join(job_dir, "inference_torch_ops.txt"), "w") as f:
+                f.write("\n\n".join(self.torch_op_tables))
+        self.enabled = False
+        return job_dir
+
+def job_profile_dir(job_id: str) -> str:
+    # basename() keeps a job id like '../..' from reaching outside of PROFILES_DIR.
+    return os.path.join(PROFILES_DIR, os.path.basename(job_id))
+
+# Instance of the job profiler. Like global_state, it covers the job currently being processed.
+job_profiler = JobProfiler()
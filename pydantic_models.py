@@ -1,3 +1,4 @@
+import os
 from typing import Optional
 
 import torch
@@ -11,6 +12,19 @@ AUDIO_QUALITY_MAP = {
     "large": "openai/whisper-large-v3"
 }
 
+# Tiers that use speculative (assisted) decoding. The draft model proposes tokens and the main model
+# verifies them, so the transcript matches the main model's own greedy output.
+# The draft must share the main model's tokenizer.
+ASSISTANT_MODEL_MAP = {
+    "large-assisted": "distil-whisper/distil-large-v3"
+}
+def assisted_decoding_enabled() -> bool:
+    return os.getenv("ENABLE_ASSISTED_DECODING", "").strip().lower() in ("1", "true", "yes", "on")
+
+# large-assisted stays opt in until benchmark_assisted.py shows it beating large on our CPU hosts.
+if assisted_decoding_enabled():
+    AUDIO_QUALITY_MAP["large-assisted"] = "openai/whisper-large-v3"
+
 COMPUTE_TYPE_MAP = {
     "default": torch.float16,
     "float16": torch.float16,
@@ -23,17 +37,32 @@ class AudioProcessRequest(BaseModel):
     youtube_url: Optional[str] = None
     file: Optional[UploadFile] = None
     audio_quality: str = Field(default="default", description="Audio quality setting for processing.")
+    chapter_selection: Optional[str] = Field(default=None, description="1-based chapters to transcribe, e.g. '2,4-6'. None transcribes every chapter.")
+    start_time: Optional[float] = Field(default=None, description="Seconds into the audio where transcription starts.")
+    end_time: Optional[float] = Field(default=None, description="Seconds into the audio where transcription ends.")
+    chunk_length_s: Optional[int] = Field(default=None, description="Overrides the autotuned chunk length (seconds) for this request.")
+    batch_size: Optional[int] = Field(default=None, description="Overrides the autotuned batch size for this request.")
+    profile: bool = Field(default=False, description="Profile this job's download, decode, slicing and inference. Admin only.")
 # This dependency function - i.e.: depends(as_form) - Tell FastAPI that
 # the data is being passed in as a form. Look for one or both or neither
 # of these fields.
 def as_form(
     youtube_url: str = Form(None),  # Use Form to specify form data
     file: UploadFile = File(None),  # Use File to specify file upload
-    audio_quality: str = Form(default="default", description="Audio quality setting for processing.  Comes in as good/better/best.")
+    audio_quality: str = Form(default="default", description="Audio quality setting for processing.  Comes in as good/better/best."),
+    chapter_selection: str = Form(None, description="1-based chapters to transcribe, e.g. '2,4-6'."),
+    start_time: float = Form(None, description="Seconds into the audio where transcription starts."),
+    end_time: float = Form(None, description="Seconds into the audio where transcription ends."),
+    chunk_length_s: int = Form(None, description="Overrides the autotuned chunk length (seconds)."),
+    batch_size: int = Form(None, description="Overrides the autotuned batch size."),
+    profile: bool = Form(False, description="Profile this job. Requires the X-Admin-Token header.")
 ) -> AudioProcessRequest:
-    return AudioProcessRequest(youtube_url=youtube_url, file=file, audio_quality= audio_quality)
+    return AudioProcessRequest(youtube_url=youtube_url, file=file, audio_quality= audio_quality,
+                               chapter_selection=chapter_selection, start_time=start_time, end_time=end_time,
+                               chunk_length_s=chunk_length_s, batch_size=batch_size, profile=profile)
 
 class GlobalState(BaseModel):
+    job_id: str = Field(default=None, description="Identifies the job, e.g. to retrieve its profile.")
     isYouTube_url: bool = Field(default=False, description="True if the original source of the mp3 file was YouTube, False if it was a local file.")
     youtube_url: str = Field(default=None, description="URL of the downloaded YouTube video.")
     basefilename: str = Field(default=None, description="Name from YouTube title or mp3 filename for Obsidian transcription filename base.")
@@ -42,10 +71,21 @@ class GlobalState(BaseModel):
     compute_type: str = Field(default="default", description="Used by the OpenAI Whisper model during audio to text (asr).")
     yaml_metadata: str = Field(default="default", description="A YouTube video's metadata to be used as Obsidian frontmatter (YAML).")
     chapters: list = Field(default_factory=list, description="Start and end time of different chapters/topics in the transcript.")
+    chapter_selection: Optional[str] = Field(default=None, description="1-based chapters requested by the client, e.g. '2,4-6'.")
+    start_time: Optional[float] = Field(default=None, description="Requested start of the transcription in seconds.")
+    end_time: Optional[float] = Field(default=None, description="Requested end of the transcription in seconds.")
+    sections: Optional[list] = Field(default=None, description="(start, end) seconds of each contiguous run of selected chapters. None means the whole source.")
+    chunk_length_s: Optional[int] = Field(default=None, description="Per request override of the autotuned chunk length (seconds).")
+    batch_size: Optional[int] = Field(default=None, description="Per request override of the autotuned batch size.")
+    audio_duration: float = Field(default=0.0, description="Seconds of audio that will be transcribed (the section length if only part was requested).")
     transcription_time: int = Field(default=0,description="Number of seconds it took to transcribe the audio file.")
+    model_load_time: float = Field(default=0.0, description="Seconds spent loading models, summed over the chapters.")
+    inference_time: float = Field(default=0.0, description="Seconds spent in inference, summed over the chapters.")
+    transcribed_seconds: float = Field(default=0.0, description="Seconds of audio transcribed so far.")
     yt_progress_updates: list = Field(default_factory=list, description="List of YouTube download progress updates.")  # Add this line
 
     def reset(self):
+        self.job_id = None
         self.isYouTube_url = False
         self.youtube_url = None
         self.basefilename = None
@@ -54,7 +94,17 @@ class GlobalState(BaseModel):
         self.compute_type = "default"
         self.yaml_metadata = None
         self.chapters = []
+        self.chapter_selection = None
+        self.start_time = None
+        self.end_time = None
+        self.sections = None
+        self.audio_duration = 0.0
+        self.chunk_length_s = None
+        self.batch_size = None
         self.transcription_time = 0
+        self.model_load_time = 0.0
+        self.inference_time = 0.0
+        self.transcribed_seconds = 0.0
         self.yt_progress_updates = []
 
 
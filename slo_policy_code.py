@@ -0,0 +1,125 @@
+import os
+import threading
+from typing import Dict, Optional
+
+from autotune_code import autotune_service
+from logger_code import LoggerBase
+from pydantic_models import AUDIO_QUALITY_MAP, ASSISTANT_MODEL_MAP, COMPUTE_TYPE_MAP
+
+# Best to worst quality. A job that would miss the SLO moves down this list until it fits.
+# large-assisted gives the same transcript as large, only faster, so it is what large tries first.
+# Tiers that aren't in AUDIO_QUALITY_MAP (large-assisted is opt in) are skipped.
+DEGRADATION_ORDER = ["large", "large-assisted", "medium", "small", "tiny"]
+
+
+class SLOPolicyService:
+    '''Keep transcriptions within a latency SLO when the service is busy.
+
+    The work of a job is its audio duration times the realtime factor (inference seconds per audio
+    second) of its model, plus the time to load the model for each chapter.  The completion time of
+    a job is estimated as the work left in the transcriptions already running plus its own work.
+    Realtime factors and load times are learned from finished jobs, with the realtime factor
+    falling back to the autotune throughput.  If the estimate is over the SLO the job is moved to a
+    smaller AUDIO_QUALITY_MAP tier or, with SLO_POLICY=reject, refused.  No SLO
+    (TRANSCRIPTION_SLO_SECONDS unset) means no policy.
+    '''
+    def __init__(self, slo_seconds: Optional[float] = None, policy: str = None):
+        slo_seconds = slo_seconds or os.getenv("TRANSCRIPTION_SLO_SECONDS")
+        self.slo_seconds = float(slo_seconds) if slo_seconds else None
+        self.policy = policy or os.getenv("SLO_POLICY", "downgrade")
+        if self.policy not in ("downgrade", "reject"):
+            raise ValueError(f"SLO_POLICY must be 'downgrade' or 'reject', not '{self.policy}'.")
+        self.realtime_factors: Dict[str, float] = {}
+        # Seconds to load a tier's model(s), which transcribe_chapter does for every chapter.
+        self.load_seconds: Dict[str, float] = {}
+        # The work left in each job that has been taken and isn't finished, by ticket.  It is kept as
+        # audio seconds and chapters rather than seconds so update_job can refresh it as chapters finish.
+        self.in_flight: Dict[int, dict] = {}
+        self.next_ticket = 0
+        self.lock = threading.Lock()
+
+    def realtime_factor(self, audio_quality: str, compute_type: str) -> Optional[float]:
+        if audio_quality in self.realtime_factors:
+            return self.realtime_factors[audio_quality]
+        hf_model_name = AUDIO_QUALITY_MAP.get(audio_quality)
+        if hf_model_name is None or audio_quality in ASSISTANT_MODEL_MAP:
+            # Autotune measures the model on its own, which says nothing about its speed with a draft model.
+            return None
+        tuned = autotune_service.settings.get(autotune_service.settings_key(hf_model_name, COMPUTE_TYPE_MAP.get(compute_type)))
+        if tuned and tuned.get("throughput"):
+            return 1 / tuned["throughput"]
+        return None
+
+    def work_seconds(self, audio_quality: str, compute_type: str, audio_seconds: float, num_chapters: int = 1) -> Optional[float]:
+        '''Seconds to transcribe audio_seconds of audio in num_chapters chapters, or None if the model's speed is unknown.'''
+        realtime_factor = self.realtime_factor(audio_quality, compute_type)
+        if realtime_factor is None:
+            return None
+        return audio_seconds * realtime_factor + num_chapters * self.load_seconds.get(audio_quality, 0.0)
+
+    def estimate_seconds(self, audio_quality: str, compute_type: str, audio_seconds: float, num_chapters: int = 1) -> Optional[float]:
+        '''Seconds until a job submitted now would finish, or None if the model's speed is unknown.'''
+        job_seconds = self.work_seconds(audio_quality, compute_type, audio_seconds, num_chapters)
+        if job_seconds is None:
+            return None
+        with self.lock:
+            jobs = list(self.in_flight.values())
+        queued_seconds = sum(self.work_seconds(**job) or 0.0 for job in jobs)
+        return queued_seconds + job_seconds
+
+    def choose_audio_quality(self, audio_quality: str, compute_type: str, audio_seconds: float, logger: LoggerBase, num_chapters: int = 1) -> str:
+        '''Return the tier to transcribe with. Raises an Exception if the job is rejected.'''
+        if self.slo_seconds is None or audio_quality not in DEGRADATION_ORDER:
+            return audio_quality
+        estimate = self.estimate_seconds(audio_quality, compute_type, audio_seconds, num_chapters)
+        if estimate is None or estimate <= self.slo_seconds:
+            return audio_quality
+        if self.policy == "reject":
+            raise Exception(f"The transcription is estimated to take {round(estimate)} seconds, which is over the {round(self.slo_seconds)} second limit. Please try again later or choose a lower audio quality.")
+        smaller_tiers = DEGRADATION_ORDER[DEGRADATION_ORDER.index(audio_quality) + 1:]
+        for tier in [tier for tier in smaller_tiers if tier in AUDIO_QUALITY_MAP]:
+            tier_estimate = self.estimate_seconds(tier, compute_type, audio_seconds, num_chapters)
+            if tier_estimate is not None and tier_estimate <= self.slo_seconds:
+                logger.info(f"slo_policy_code.choose_audio_quality: {audio_quality} estimated at {round(estimate)}s, using {tier} ({round(tier_estimate)}s).")
+                return tier
+        # Nothing fits, so go with the fastest.
+        logger.info(f"slo_policy_code.choose_audio_quality: {audio_quality} estimated at {round(estimate)}s, no tier meets the SLO. Using {DEGRADATION_ORDER[-1]}.")
+        return DEGRADATION_ORDER[-1]
+
+    def start_job(self, audio_quality: str, compute_type: str, audio_seconds: float, num_chapters: int = 1) -> int:
+        '''Count the job's work toward the estimates of later jobs. Returns the ticket to hand to update_job and finish_job.'''
+        with self.lock:
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            self.in_flight[ticket] = {"audio_quality": audio_quality, "compute_type": compute_type,
+                                      "audio_seconds": audio_seconds, "num_chapters": num_chapters}
+        return ticket
+
+    def update_job(self, ticket: int, audio_seconds: float, num_chapters: int) -> None:
+        '''Set the audio seconds and chapters the job has left to transcribe.'''
+        with self.lock:
+            if ticket in self.in_flight:
+                self.in_flight[ticket].update(audio_seconds=max(audio_seconds, 0.0), num_chapters=max(num_chapters, 0))
+
+    def finish_job(self, ticket: int) -> None:
+        with self.lock:
+            self.in_flight.pop(ticket, None)
+
+    def record_realtime_factor(self, audio_quality: str, audio_seconds: float, inference_seconds: float) -> None:
+        '''Learn from a finished job. inference_seconds leaves out loading the model, see record_load_seconds.'''
+        if audio_seconds <= 0:
+            return
+        smooth(self.realtime_factors, audio_quality, inference_seconds / audio_seconds)
+
+    def record_load_seconds(self, audio_quality: str, load_seconds: float, num_chapters: int) -> None:
+        if num_chapters <= 0:
+            return
+        smooth(self.load_seconds, audio_quality, load_seconds / num_chapters)
+
+def smooth(values: Dict[str, float], audio_quality: str, value: float) -> None:
+    # Smooth out one-off slow or fast jobs.
+    previous = values.get(audio_quality)
+    values[audio_quality] = value if previous is None else 0.7 * previous + 0.3 * value
+
+# Instance shared by the app.
+slo_policy_service = SLOPolicyService()
@@ -0,0 +1,16 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+from pydantic_models import assisted_decoding_enabled
+
+@pytest.mark.parametrize("value, enabled", [("1", True), ("true", True), ("On", True), ("0", False), ("false", False), ("", False)])
+def test_enable_assisted_decoding_flag(monkeypatch, value, enabled):
+    monkeypatch.setenv("ENABLE_ASSISTED_DECODING", value)
+    assert assisted_decoding_enabled() == enabled
+
+def test_process_audio_rejects_unknown_tiers(monkeypatch):
+    monkeypatch.delitem(app.AUDIO_QUALITY_MAP, "large-assisted", raising=False)
+    response = TestClient(app.app).post("/api/v1/process_audio", data={"youtube_url": "https://www.youtube.com/watch?v=KbZDsrs5roI", "audio_quality": "large-assisted"})
+    assert response.status_code == 400
+    assert "large-assisted" in response.json()["detail"]
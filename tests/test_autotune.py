@@ -0,0 +1,101 @@
+import pytest
+import torch
+
+import autotune_code
+import transcribe_code
+from autotune_code import AutoTuneService, DEFAULT_BATCH_SIZE, DEFAULT_CHUNK_LENGTH_S
+from logger_code import LoggerBase
+from pydantic_models import AUDIO_QUALITY_MAP
+
+# Throughput and peak memory each candidate "measures" at.
+MEASUREMENTS = {
+    (15, 1): (2.0, 100.0),
+    (15, 2): (3.0, 200.0),
+    (15, 4): (4.0, 900.0),
+    (30, 1): (2.5, 150.0),
+    (30, 2): (3.5, 300.0),
+}
+
+@pytest.fixture
+def logger():
+    return LoggerBase.setup_logger('test_autotune')
+
+@pytest.fixture
+def clip(tmp_path):
+    clip = tmp_path / "speech.mp3"
+    clip.write_bytes(b"")
+    return str(clip)
+
+@pytest.fixture
+def service(tmp_path, clip, monkeypatch):
+    service = AutoTuneService(settings_filepath=str(tmp_path / "autotune.json"), calibration_audio_filepath=clip)
+    loaded_models = []
+    monkeypatch.setattr(transcribe_code, "load_transcriber", lambda hf_model_name, *_: loaded_models.append(hf_model_name) or (lambda *args, **kwargs: None))
+    monkeypatch.setattr(service, "load_calibration_audio", lambda: {"raw": [0.0] * 16000, "sampling_rate": 16000})
+
+    def measure(transcriber, audio, chunk_length_s, batch_size):
+        if (chunk_length_s, batch_size) not in MEASUREMENTS:
+            raise RuntimeError("out of memory")
+        throughput, peak_memory_mb = MEASUREMENTS[(chunk_length_s, batch_size)]
+        return {"chunk_length_s": chunk_length_s, "batch_size": batch_size, "throughput": throughput, "peak_memory_mb": peak_memory_mb}
+    monkeypatch.setattr(service, "measure", measure)
+    service.loaded_models = loaded_models
+    return service
+
+def test_get_settings_falls_back_to_defaults(service):
+    assert service.get_settings("openai/whisper-tiny.en", torch.float32) == (DEFAULT_CHUNK_LENGTH_S, DEFAULT_BATCH_SIZE)
+
+def test_calibrate_picks_the_fastest_and_stops_on_runtime_error(service, logger):
+    best = service.calibrate("openai/whisper-tiny.en", torch.float32, logger)
+    # (15, 8) and (30, 4) raise, so the larger batches after them are never tried.
+    assert (best["chunk_length_s"], best["batch_size"]) == (15, 4)
+
+def test_calibrate_respects_the_memory_cap(service, logger):
+    service.max_memory_mb = 500
+    best = service.calibrate("openai/whisper-tiny.en", torch.float32, logger)
+    assert (best["chunk_length_s"], best["batch_size"]) == (30, 2)
+
+def test_calibrate_with_nothing_under_the_cap(service, logger):
+    service.max_memory_mb = 50
+    with pytest.raises(Exception, match="No chunk length/batch size"):
+        service.calibrate("openai/whisper-tiny.en", torch.float32, logger)
+
+def test_calibration_is_persisted_and_reloaded(service, logger, clip):
+    service.calibrate("openai/whisper-tiny.en", torch.float32, logger)
+    reloaded = AutoTuneService(settings_filepath=service.settings_filepath, calibration_audio_filepath=clip)
+    assert reloaded.get_settings("openai/whisper-tiny.en", torch.float32) == (15, 4)
+    # Other dtypes were not tuned.
+    assert reloaded.get_settings("openai/whisper-tiny.en", torch.float16) == (DEFAULT_CHUNK_LENGTH_S, DEFAULT_BATCH_SIZE)
+
+def test_calibrate_qualities_tunes_shared_models_once(service, logger):
+    results = service.calibrate_qualities(["default", "tiny", "small"], "float32", logger)
+    assert list(results) == [AUDIO_QUALITY_MAP["tiny"], AUDIO_QUALITY_MAP["small"]]
+    assert service.loaded_models == [AUDIO_QUALITY_MAP["tiny"], AUDIO_QUALITY_MAP["small"]]
+
+def test_calibrate_qualities_rejects_unknown_tiers_before_loading(service, logger):
+    with pytest.raises(ValueError, match="Unknown audio quality"):
+        service.calibrate_qualities(["tiny", "huge"], "float32", logger)
+    assert service.loaded_models == []
+
+def test_calibrate_qualities_needs_a_speech_clip(service, logger):
+    service.calibration_audio_filepath = None
+    with pytest.raises(ValueError, match="AUTOTUNE_AUDIO_FILEPATH"):
+        service.calibrate_qualities(["tiny"], "float32", logger)
+
+def test_measure(tmp_path):
+    service = AutoTuneService(settings_filepath=str(tmp_path / "autotune.json"))
+    result = service.measure(lambda audio, **kwargs: None, {"raw": [0.0] * 32000, "sampling_rate": 16000}, 30, 2)
+    assert result["chunk_length_s"] == 30 and result["batch_size"] == 2
+    assert result["throughput"] > 0 and result["peak_memory_mb"] >= 0
+
+def test_host_key_uses_available_cpus(tmp_path, monkeypatch):
+    monkeypatch.setattr(torch.cuda, "is_available", lambda: False)
+    monkeypatch.setattr(autotune_code.torch, "get_num_threads", lambda: 3)
+    assert AutoTuneService(settings_filepath=str(tmp_path / "autotune.json")).host_key() == "cpu:3"
+
+@pytest.mark.parametrize("override", [{"chunk_length_s": "0"}, {"batch_size": "-2"}])
+def test_process_audio_rejects_non_positive_overrides(override):
+    from fastapi.testclient import TestClient
+    import app
+    response = TestClient(app.app).post("/api/v1/process_audio", data={"youtube_url": "https://www.youtube.com/watch?v=KbZDsrs5roI", **override})
+    assert response.status_code == 400
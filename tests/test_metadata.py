@@ -0,0 +1,85 @@
+import pytest
+
+from metadata_code import MetadataService
+from pydantic_models import global_state
+
+@pytest.fixture
+def metadata_service():
+    return MetadataService()
+
+@pytest.fixture
+def chapters():
+    return [
+        {'start_time': 0.0, 'end_time': 60.0, 'title': 'Intro'},
+        {'start_time': 60.0, 'end_time': 120.0, 'title': 'Setup'},
+        {'start_time': 120.0, 'end_time': 180.0, 'title': 'Demo'},
+        {'start_time': 180.0, 'end_time': 300.0, 'title': 'Wrap up'},
+    ]
+
+@pytest.fixture(autouse=True)
+def reset_global_state():
+    global_state.reset()
+    yield
+    global_state.reset()
+
+def test_parse_chapter_selection(metadata_service):
+    assert metadata_service.parse_chapter_selection("2, 4-5,1", 5) == [0, 1, 3, 4]
+    assert metadata_service.parse_chapter_selection("3,3", 5) == [2]
+
+@pytest.mark.parametrize("selection", ["0", "6", "4-2", "a", ",", "1-b"])
+def test_parse_chapter_selection_invalid(metadata_service, selection):
+    with pytest.raises(ValueError):
+        metadata_service.parse_chapter_selection(selection, 5)
+
+def test_select_section_whole_source(metadata_service, chapters):
+    assert metadata_service.select_section(chapters, 300) == (chapters, None)
+
+def test_select_section_chapters_are_split_into_contiguous_sections(metadata_service, chapters):
+    global_state.update(chapter_selection="1,2,4")
+    selected, sections = metadata_service.select_section(chapters, 300)
+    assert [chapter['title'] for chapter in selected] == ['Intro', 'Setup', 'Wrap up']
+    assert sections == [(0.0, 120.0), (180.0, 300.0)]
+    assert metadata_service.selected_duration(selected) == 240.0
+
+def test_select_section_time_range_clips_chapters(metadata_service, chapters):
+    global_state.update(start_time=90.0, end_time=150.0)
+    selected, sections = metadata_service.select_section(chapters, 300)
+    assert [(chapter['start_time'], chapter['end_time']) for chapter in selected] == [(90.0, 120.0), (120.0, 150.0)]
+    assert sections == [(90.0, 150.0)]
+
+def test_select_section_time_range_without_chapters(metadata_service):
+    global_state.update(start_time=30.0, end_time=500.0)
+    selected, sections = metadata_service.select_section([], 300)
+    # end_time is clipped to the length of the audio.
+    assert selected == [{'start_time': 30.0, 'end_time': 300.0, 'title': ''}]
+    assert sections == [(30.0, 300.0)]
+
+@pytest.mark.parametrize("start_time, end_time", [
+    (-20.0, None),
+    (300.0, None),
+    (500.0, None),
+    (None, -5.0),
+    (None, 0.0),
+    (100.0, 50.0),
+    (100.0, 100.0),
+])
+def test_select_section_start_time_out_of_range(metadata_service, start_time, end_time):
+    global_state.update(start_time=start_time, end_time=end_time)
+    with pytest.raises(ValueError):
+        metadata_service.select_section([], 300)
+
+def test_select_section_end_before_start_with_unknown_duration(metadata_service):
+    global_state.update(start_time=100.0, end_time=50.0)
+    with pytest.raises(ValueError):
+        metadata_service.select_section([], 0)
+
+def test_select_section_chapters_requested_without_chapters(metadata_service):
+    global_state.update(chapter_selection="1")
+    with pytest.raises(ValueError):
+        metadata_service.select_section([], 300)
+
+def test_add_section_metadata(metadata_service, chapters):
+    metadata = {}
+    metadata_service.add_section_metadata(metadata, [chapters[0], chapters[3]], [(0.0, 60.0), (180.0, 300.0)])
+    assert metadata["transcribed sections"] == ["0:00:00 - 0:01:00", "0:03:00 - 0:05:00"]
+    assert metadata["transcribed chapters"] == ["Intro", "Wrap up"]
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+import torch
+from fastapi import HTTPException
+
+import profiling_code
+import transcribe_code
+from app import require_admin
+from logger_code import LoggerBase
+from pydantic_models import global_state
+from profiling_code import JobProfiler, job_profile_dir
+
+def test_job_profile_dir_stays_in_profiles_dir():
+    assert job_profile_dir("abc123") == os.path.join(profiling_code.PROFILES_DIR, "abc123")
+    assert job_profile_dir("../../etc") == os.path.join(profiling_code.PROFILES_DIR, "etc")
+
+@pytest.mark.parametrize("admin_token, x_admin_token", [
+    (None, "secret"),      # Admin features are off when ADMIN_TOKEN isn't set.
+    ("secret", None),
+    ("secret", "wrong"),
+])
+def test_require_admin_rejects(monkeypatch, admin_token, x_admin_token):
+    if admin_token:
+        monkeypatch.setenv("ADMIN_TOKEN", admin_token)
+    else:
+        monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    with pytest.raises(HTTPException) as e:
+        require_admin(x_admin_token)
+    assert e.value.status_code == 403
+
+def test_require_admin_accepts(monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    require_admin("secret")
+
+def test_disabled_profiler_writes_nothing():
+    profiler = JobProfiler()
+    with profiler.stage("decode"), profiler.torch_ops("inference", torch.nn.Linear(4, 4)):
+        pass
+    assert profiler.save() is None
+
+def test_profile_artifacts(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling_code, "PROFILES_DIR", str(tmp_path))
+    monkeypatch.setattr(profiling_code, "TORCH_PROFILER_STEPS", 2)
+    profiler = JobProfiler()
+    profiler.start("job1")
+    model = torch.nn.Linear(4, 4)
+    with profiler.stage("inference"), profiler.torch_ops("chapter", model):
+        for _ in range(10):
+            model(torch.randn(1, 4))
+    job_dir = profiler.save()
+    assert sorted(os.listdir(job_dir)) == ["inference.prof", "inference.txt", "inference_torch_ops.txt"]
+    with open(os.path.join(job_dir, "inference_torch_ops.txt")) as f:
+        linear_rows = [line for line in f if "aten::linear" in line]
+    # Only the forward passes after the warmup one, up to TORCH_PROFILER_STEPS, are recorded.
+    assert linear_rows and linear_rows[0].split()[-1] == "2"
+
+@pytest.mark.asyncio
+async def test_torch_ops_are_labelled_by_chapter(monkeypatch):
+    labels = []
+    monkeypatch.setattr(transcribe_code, "slice_audio", lambda *_: "temp.wav")
+    monkeypatch.setattr(transcribe_code, "transcribe_chapter", lambda *_, label=None, **__: labels.append(label) or "")
+    chapters = [{'start_time': 0.0, 'end_time': 60.0, 'title': 'Intro'},
+                {'start_time': 60.0, 'end_time': 3725.0, 'title': ''}]
+    async for _ in transcribe_code.transcribe_chapters(chapters, LoggerBase.setup_logger('test_profiling'), "audio.mp3"):
+        pass
+    assert labels == ["Chapter 1/2: Intro (00:00:00 - 00:01:00)", "Chapter 2/2: untitled (00:01:00 - 01:02:05)"]
+    global_state.reset()
@@ -0,0 +1,108 @@
+import pytest
+
+import app
+from logger_code import LoggerBase
+from pydantic_models import global_state, AUDIO_QUALITY_MAP
+from slo_policy_code import SLOPolicyService
+
+@pytest.fixture
+def logger():
+    return LoggerBase.setup_logger('test_slo_policy')
+
+@pytest.fixture
+def policy():
+    policy = SLOPolicyService(slo_seconds=600, policy="downgrade")
+    # Wall clock seconds per second of audio.
+    policy.realtime_factors.update({"large": 2.0, "medium": 0.8, "small": 0.3, "tiny": 0.1})
+    return policy
+
+def test_no_slo_keeps_the_requested_tier(logger):
+    policy = SLOPolicyService(slo_seconds=None)
+    assert policy.choose_audio_quality("large", "default", 36000, logger) == "large"
+
+def test_within_slo_keeps_the_requested_tier(policy, logger):
+    assert policy.choose_audio_quality("large", "default", 300, logger) == "large"
+
+def test_unknown_speed_keeps_the_requested_tier(logger):
+    policy = SLOPolicyService(slo_seconds=600)
+    assert policy.choose_audio_quality("large", "default", 3600, logger) == "large"
+
+def test_downgrades_to_the_largest_tier_that_fits(policy, logger):
+    assert policy.choose_audio_quality("large", "default", 600, logger) == "medium"
+
+def test_queued_work_counts(policy, logger):
+    ticket = policy.start_job("large", "default", 200)
+    assert policy.choose_audio_quality("medium", "default", 300, logger) == "small"
+    policy.finish_job(ticket)
+    assert policy.choose_audio_quality("medium", "default", 300, logger) == "medium"
+
+def test_queued_work_shrinks_as_chapters_finish(policy, logger):
+    ticket = policy.start_job("large", "default", 200, num_chapters=2)
+    assert policy.choose_audio_quality("medium", "default", 300, logger) == "small"
+    policy.update_job(ticket, 100, 1)
+    assert policy.estimate_seconds("medium", "default", 300) == pytest.approx(100 * 2.0 + 300 * 0.8)
+    assert policy.choose_audio_quality("medium", "default", 300, logger) == "medium"
+
+def test_model_load_is_paid_per_chapter(policy, logger):
+    policy.load_seconds["medium"] = 30
+    assert policy.estimate_seconds("medium", "default", 300, num_chapters=3) == pytest.approx(300 * 0.8 + 3 * 30)
+    assert policy.choose_audio_quality("large", "default", 600, logger, num_chapters=6) == "small"
+
+def test_nothing_fits_uses_tiny(policy, logger):
+    assert policy.choose_audio_quality("large", "default", 36000, logger) == "tiny"
+
+def test_large_tries_large_assisted_first(policy, logger, monkeypatch):
+    monkeypatch.setitem(AUDIO_QUALITY_MAP, "large-assisted", "openai/whisper-large-v3")
+    policy.realtime_factors["large-assisted"] = 0.9
+    assert policy.choose_audio_quality("large", "default", 600, logger) == "large-assisted"
+
+def test_large_assisted_is_skipped_when_not_enabled(policy, logger, monkeypatch):
+    monkeypatch.delitem(AUDIO_QUALITY_MAP, "large-assisted", raising=False)
+    policy.realtime_factors["large-assisted"] = 0.9
+    assert policy.choose_audio_quality("large", "default", 600, logger) == "medium"
+
+def test_reject(policy, logger):
+    policy.policy = "reject"
+    with pytest.raises(Exception):
+        policy.choose_audio_quality("large", "default", 600, logger)
+
+def test_record_realtime_factor_smooths(policy):
+    policy.record_realtime_factor("small", 100, 50)
+    assert policy.realtime_factors["small"] == pytest.approx(0.7 * 0.3 + 0.3 * 0.5)
+    policy.record_realtime_factor("new", 100, 50)
+    assert policy.realtime_factors["new"] == 0.5
+    policy.record_realtime_factor("empty", 0, 50)
+    assert "empty" not in policy.realtime_factors
+
+def test_record_load_seconds_is_per_chapter(policy):
+    policy.record_load_seconds("small", 30, 3)
+    assert policy.load_seconds["small"] == 10
+    policy.record_load_seconds("small", 40, 2)
+    assert policy.load_seconds["small"] == pytest.approx(0.7 * 10 + 0.3 * 20)
+    policy.record_load_seconds("tiny", 30, 0)
+    assert "tiny" not in policy.load_seconds
+
+@pytest.mark.parametrize("audio_seconds, tier, requested_tier", [(300, "large", None), (600, "medium", "large")])
+def test_apply_slo_policy_records_the_tier(policy, monkeypatch, audio_seconds, tier, requested_tier):
+    monkeypatch.setattr(app, "slo_policy_service", policy)
+    global_state.reset()
+    global_state.update(audio_quality="large", audio_duration=audio_seconds, yaml_metadata={"audio quality": AUDIO_QUALITY_MAP["large"]})
+    app.apply_slo_policy()
+    assert global_state.yaml_metadata["audio quality"] == AUDIO_QUALITY_MAP[tier]
+    assert global_state.yaml_metadata["audio quality tier"] == tier
+    assert global_state.yaml_metadata.get("requested audio quality tier") == requested_tier
+    global_state.reset()
+
+@pytest.mark.asyncio
+async def test_rejected_upload_is_deleted_before_transcription(policy, tmp_path, monkeypatch):
+    policy.policy = "reject"
+    mp3_filepath = tmp_path / "upload.mp3"
+    mp3_filepath.write_bytes(b"")
+    monkeypatch.setattr(app, "slo_policy_service", policy)
+    monkeypatch.setattr(app.metadata_service, "extract_mp3_metadata", lambda _: {"audio quality": "openai/whisper-large-v3"})
+    global_state.reset()
+    global_state.update(mp3_filepath=str(mp3_filepath), audio_quality="large", audio_duration=600)
+    events = [event async for event in app.job_event_stream()]
+    assert len(events) == 1 and '"error"' in events[0]
+    assert not mp3_filepath.exists()
+    global_state.reset()
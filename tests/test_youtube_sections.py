@@ -0,0 +1,48 @@
+import pytest
+
+from logger_code import LoggerBase
+from pydantic_models import global_state
+from youtube_download_code import YouTubeDownloader
+
+@pytest.fixture
+def downloader():
+    global_state.reset()
+    yield YouTubeDownloader('https://www.youtube.com/watch?v=KbZDsrs5roI', LoggerBase.setup_logger('test_youtube_sections'))
+    global_state.reset()
+
+def test_chapters_point_at_their_section_mp3(downloader):
+    global_state.update(
+        chapters=[
+            {'start_time': 0.0, 'end_time': 60.0, 'title': 'Intro'},
+            {'start_time': 60.0, 'end_time': 120.0, 'title': 'Setup'},
+            {'start_time': 180.0, 'end_time': 300.0, 'title': 'Wrap up'},
+        ],
+        sections=[(0.0, 120.0), (180.0, 300.0)])
+    # What yt-dlp reports once each section has been converted to mp3.
+    for section_start, filepath in [(0.0, 'temp/downloaded_file-0.mp3'), (180.0, 'temp/downloaded_file-180.mp3')]:
+        downloader.postprocessor_hook({'postprocessor': 'ExtractAudio', 'status': 'finished',
+                                       'info_dict': {'section_start': section_start, 'filepath': filepath}})
+    downloader.assign_chapter_mp3_filepaths()
+    assert [(chapter['mp3_filepath'], chapter['audio_offset']) for chapter in global_state.chapters] == [
+        ('temp/downloaded_file-0.mp3', 0.0),
+        ('temp/downloaded_file-0.mp3', 0.0),
+        ('temp/downloaded_file-180.mp3', 180.0),
+    ]
+    assert downloader.mp3_filepath == 'temp/downloaded_file-0.mp3'
+
+def test_missing_section_mp3(downloader):
+    global_state.update(chapters=[{'start_time': 180.0, 'end_time': 300.0, 'title': 'Wrap up'}], sections=[(180.0, 300.0)])
+    downloader.postprocessor_hook({'postprocessor': 'ExtractAudio', 'status': 'finished',
+                                   'info_dict': {'section_start': 179.5, 'filepath': 'temp/downloaded_file-179.5.mp3'}})
+    with pytest.raises(Exception, match="did not produce an mp3 for the section starting at 180.0"):
+        downloader.assign_chapter_mp3_filepaths()
+
+def test_no_mp3(downloader):
+    with pytest.raises(Exception, match="without producing an mp3"):
+        downloader.mp3_filepath
+
+def test_whole_video_download(downloader):
+    downloader.postprocessor_hook({'postprocessor': 'ExtractAudio', 'status': 'finished',
+                                   'info_dict': {'filepath': 'temp/downloaded_file.mp3'}})
+    downloader.assign_chapter_mp3_filepaths()
+    assert downloader.mp3_filepath == 'temp/downloaded_file.mp3'
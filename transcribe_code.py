@@ -5,14 +5,29 @@ import time
 
 from pydub import AudioSegment
 import torch
-from transformers import pipeline
+from transformers import AutoModelForSpeechSeq2Seq, pipeline
+from transformers.pipelines.audio_utils import ffmpeg_read
 
+from autotune_code import autotune_service
 from logger_code import LoggerBase
-from pydantic_models import  global_state, AUDIO_QUALITY_MAP, COMPUTE_TYPE_MAP
+from profiling_code import job_profiler
+from pydantic_models import  global_state, AUDIO_QUALITY_MAP, ASSISTANT_MODEL_MAP, COMPUTE_TYPE_MAP
 
 async def transcribe_mp3(local_mp3_filepath: str, logger: LoggerBase):
-    whisper_model = AUDIO_QUALITY_MAP.get(global_state.audio_quality, "distil-whisper/distil-large-v3")
+    # process_audio only lets through tiers that are in AUDIO_QUALITY_MAP.
+    whisper_model = AUDIO_QUALITY_MAP[global_state.audio_quality]
+    assistant_model = ASSISTANT_MODEL_MAP.get(global_state.audio_quality)
     torch_compute_type = COMPUTE_TYPE_MAP.get(global_state.compute_type)
+    # Use what autotune found best for this model on this host unless the request overrides it.
+    chunk_length_s, batch_size = autotune_service.get_settings(whisper_model, torch_compute_type)
+    if global_state.chunk_length_s is not None:
+        chunk_length_s = global_state.chunk_length_s
+    if global_state.batch_size is not None:
+        batch_size = global_state.batch_size
+    if assistant_model:
+        # transformers only supports assisted generation one sequence at a time.
+        batch_size = 1
+    logger.debug(f"Using chunk_length_s={chunk_length_s}, batch_size={batch_size} for {whisper_model}, assistant model: {assistant_model}")
     logger.debug(f"Transcribing file path: {local_mp3_filepath}")
     # Send the filename w/o extension to the client. This becomes the name of the obsidian note.
     yield {'filename': os.path.splitext(os.path.basename(local_mp3_filepath))[0]}
@@ -29,7 +44,7 @@ async def transcribe_mp3(local_mp3_filepath: str, logger: LoggerBase):
 
     start_time = time.time()
     # Transcribed chapters are sent to Obsidian as they become available.
-    async for chapter in transcribe_chapters(chapters, logger, local_mp3_filepath, whisper_model, torch_compute_type):
+    async for chapter in transcribe_chapters(chapters, logger, local_mp3_filepath, whisper_model, torch_compute_type, chunk_length_s, batch_size, assistant_model):
         yield chapter
     end_time = time.time()
     transcription_time = round(end_time - start_time, 1)
@@ -37,46 +52,86 @@ async def transcribe_mp3(local_mp3_filepath: str, logger: LoggerBase):
 
 # For use with more than one chapter, define a function to slice audio
 def slice_audio(local_mp3_filepath: str, start_ms: int, end_ms: int) -> str:
-    audio = AudioSegment.from_file(local_mp3_filepath)
-    audio_segment = audio[start_ms:end_ms]
-    temp_audio_path = "temp.wav"
-    audio_segment.export(temp_audio_path, format="wav")
+    with job_profiler.stage("decode"):
+        audio = AudioSegment.from_file(local_mp3_filepath)
+    with job_profiler.stage("slice"):
+        audio_segment = audio[start_ms:end_ms]
+        temp_audio_path = "temp.wav"
+        audio_segment.export(temp_audio_path, format="wav")
     return temp_audio_path
 
 
 
-def transcribe_chapter(mp3_file: str, hf_model_name: str = "distil-whisper/distil-large-v3", compute_type_pytorch: torch.dtype = torch.float16) -> str:
+def load_transcriber(hf_model_name: str = "distil-whisper/distil-large-v3", compute_type_pytorch: torch.dtype = torch.float16,
+                     assistant_model_name: str = None):
+    generate_kwargs = {}
+    if assistant_model_name:
+        # Speculative decoding: the small draft model proposes tokens and hf_model_name verifies them.
+        assistant_model = AutoModelForSpeechSeq2Seq.from_pretrained(assistant_model_name,
+                                                                    torch_dtype=compute_type_pytorch,
+                                                                    low_cpu_mem_usage=True)
+        assistant_model.to("cuda:0" if torch.cuda.is_available() else "cpu")
+        generate_kwargs["assistant_model"] = assistant_model
+    return pipeline("automatic-speech-recognition",
+                    model=hf_model_name,
+                    device=0 if torch.cuda.is_available() else -1,
+                    torch_dtype=compute_type_pytorch,
+                    generate_kwargs=generate_kwargs)
+
+def transcribe_chapter(mp3_file: str, hf_model_name: str = "distil-whisper/distil-large-v3", compute_type_pytorch: torch.dtype = torch.float16,
+                       chunk_length_s: int = 30, batch_size: int = 8, assistant_model_name: str = None, label: str = None) -> str:
     # Load model
-    transcriber = pipeline("automatic-speech-recognition",
-                           model=hf_model_name,
-                           device=0 if torch.cuda.is_available() else -1,
-                           torch_dtype=compute_type_pytorch)
+    # Loading and inference are timed apart. The SLO policy learns the speed of inference per second
+    # of audio, and the load time as a cost paid once per chapter.
+    load_start_time = time.time()
+    with job_profiler.stage("load_model"):
+        transcriber = load_transcriber(hf_model_name, compute_type_pytorch, assistant_model_name)
+    global_state.model_load_time += time.time() - load_start_time
+
+    # Decode here rather than inside the pipeline (which does the same ffmpeg read) so a profile
+    # shows decoding on its own, even when the whole file is transcribed and nothing is sliced.
+    with job_profiler.stage("decode"):
+        with open(mp3_file, "rb") as f:
+            audio = ffmpeg_read(f.read(), transcriber.feature_extractor.sampling_rate)
 
     # Transcribe
-    result = transcriber(mp3_file, chunk_length_s=30, batch_size=8)
+    inference_start_time = time.time()
+    with job_profiler.stage("inference"), job_profiler.torch_ops(label or mp3_file, transcriber.model):
+        result = transcriber(audio, chunk_length_s=chunk_length_s, batch_size=batch_size)
+    global_state.inference_time += time.time() - inference_start_time
 
     return result['text']
 
-async def transcribe_chapters(chapters: list, logger: LoggerBase, local_mp3_filepath: str, hf_model_name: str = "distil-whisper/distil-large-v3", compute_type_pytorch: torch.dtype = torch.float16):
-    for chapter in chapters:
+async def transcribe_chapters(chapters: list, logger: LoggerBase, local_mp3_filepath: str, hf_model_name: str = "distil-whisper/distil-large-v3", compute_type_pytorch: torch.dtype = torch.float16,
+                              chunk_length_s: int = 30, batch_size: int = 8, assistant_model_name: str = None):
+    for index, chapter in enumerate(chapters, start=1):
         logger.debug(f'transcribe_code.transcribe_chapters: processing chapter {chapter}')
-        start_ms = int(chapter['start_time'] * 1000)
-        end_ms = int(chapter['end_time'] * 1000) if chapter['end_time'] > 0.0 else None # None happens when input not from YouTube.
+        # After a ranged download each section has its own mp3 that starts audio_offset seconds into the source.
+        chapter_mp3_filepath = chapter.get('mp3_filepath', local_mp3_filepath)
+        audio_offset = chapter.get('audio_offset', 0.0)
+        start_ms = int((chapter['start_time'] - audio_offset) * 1000)
+        end_ms = int((chapter['end_time'] - audio_offset) * 1000) if chapter['end_time'] > 0.0 else None # None happens when input not from YouTube.
         title = chapter['title'] if len(chapter['title']) > 0 else None
+        start_time_str = time.strftime('%H:%M:%S', time.gmtime(chapter['start_time']))
+        end_time_str = time.strftime('%H:%M:%S', time.gmtime(chapter['end_time']))
+        # Names the chapter in the profile. The audio file itself is often the shared temp.wav.
+        label = f"Chapter {index}/{len(chapters)}: {title or 'untitled'} ({start_time_str} - {end_time_str})" if end_ms else f"Chapter {index}/{len(chapters)}: whole file"
         # Slice the audio if end_ms is provided, otherwise use the entire file
-        mp3_path = slice_audio(local_mp3_filepath, start_ms, end_ms) if end_ms else local_mp3_filepath
+        mp3_path = slice_audio(chapter_mp3_filepath, start_ms, end_ms) if end_ms else chapter_mp3_filepath
         # Transcribe the audio segment
-        transcription = transcribe_chapter(mp3_path, hf_model_name=hf_model_name, compute_type_pytorch=compute_type_pytorch)
+        transcription = transcribe_chapter(mp3_path, hf_model_name=hf_model_name, compute_type_pytorch=compute_type_pytorch,
+                                           chunk_length_s=chunk_length_s, batch_size=batch_size,
+                                           assistant_model_name=assistant_model_name, label=label)
         transcription_chapter = ''
         # Write to Markdown file
         if title:
             transcription_chapter += f"\n## {title}\n"
         if end_ms:
             # There are more than one chapter so add start and end times of where the text is with respect to the transcript.
-            start_time_str = time.strftime('%H:%M:%S', time.gmtime(chapter['start_time']))
-            end_time_str = time.strftime('%H:%M:%S', time.gmtime(chapter['end_time']))
             transcription_chapter += f"{start_time_str} - {end_time_str}\n"
         transcription_chapter += f"\n{transcription}"
+        # A chapter without an end time is the whole file.
+        global_state.transcribed_seconds += chapter['end_time'] - chapter['start_time'] if end_ms else global_state.audio_duration
 
         # Yield progress event for each chapter
         yield {'chapter': transcription_chapter}
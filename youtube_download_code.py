@@ -5,8 +5,9 @@ from typing import AsyncGenerator
 from fastapi import HTTPException
 import yt_dlp
 
-from pydantic_models import AudioProcessRequest
+from pydantic_models import AudioProcessRequest, global_state
 from metadata_code import MetadataService
+from profiling_code import job_profiler
 
 class YouTubeDownloader:
     def __init__(self, yt_url: str, logger: object):
@@ -15,13 +16,14 @@ class YouTubeDownloader:
         self.yt_progress_updates = Queue()
         self.isComplete = False
         self.base_temp_mp3_filepath = "temp/downloaded_file"
+        # mp3 filepath by section start (None when the whole video is downloaded).
+        self.mp3_filepaths = {}
 
 
     def progress_hook(self, d):
         status = d.get('status')
         if status == 'finished':
             self.yt_progress_updates.put("Download finished successfully.")
-            self.isComplete = True
         elif status == 'downloading':
             downloaded = d.get('downloaded_bytes')
             total = d.get('total_bytes')
@@ -30,20 +32,57 @@ class YouTubeDownloader:
                 self.yt_progress_updates.put(f"Downloading: {percentage:.1f}%")
         elif status == 'error':
             self.yt_progress_updates.put(f"An error occurred: {d.get('error', 'Unknown error')}")
-            self.isComplete = True
+
+    def postprocessor_hook(self, d):
+        # Once ExtractAudio is done, info_dict['filepath'] is the mp3.
+        if d.get('postprocessor') == 'ExtractAudio' and d.get('status') == 'finished':
+            info_dict = d['info_dict']
+            self.mp3_filepaths[info_dict.get('section_start')] = info_dict['filepath']
 
     def download_yt_to_mp3(self):
         ydl_opts = {
             'format': 'bestaudio/best',
             'outtmpl': self.base_temp_mp3_filepath,
             'progress_hooks': [self.progress_hook],
+            'postprocessor_hooks': [self.postprocessor_hook],
             'postprocessors': [{
                 'key': 'FFmpegExtractAudio',
                 'preferredcodec': 'mp3',
             }]
         }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([self.yt_url])
+        if global_state.sections:
+            # Only part of the video was asked for.  Have yt-dlp fetch just those sections
+            # (--download-sections) rather than the whole video.  Each section becomes its own mp3.
+            ydl_opts['download_ranges'] = yt_dlp.utils.download_range_func(None, global_state.sections)
+            ydl_opts['force_keyframes_at_cuts'] = True
+            ydl_opts['outtmpl'] = f"{self.base_temp_mp3_filepath}-%(section_start)s"
+        # This runs in an executor thread, which the download profile (if on) covers.
+        try:
+            with job_profiler.stage("download"), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                ydl.download([self.yt_url])
+        finally:
+            # There can be several downloads (one per section), so only stop reporting progress once all are done.
+            self.isComplete = True
+
+    def assign_chapter_mp3_filepaths(self) -> None:
+        '''Point each chapter at the mp3 of the section it is in and where in the source that mp3 starts.'''
+        if not global_state.sections:
+            return
+        for chapter in global_state.chapters:
+            section_start = next((start for start, end in global_state.sections if start <= chapter['start_time'] < end), None)
+            if section_start is None:
+                raise Exception(f"Chapter '{chapter['title']}' at {chapter['start_time']} seconds is not in any of the requested sections {global_state.sections}.")
+            if section_start not in self.mp3_filepaths:
+                raise Exception(f"yt-dlp did not produce an mp3 for the section starting at {section_start} seconds. It produced sections starting at {list(self.mp3_filepaths)}.")
+            chapter['mp3_filepath'] = self.mp3_filepaths[section_start]
+            chapter['audio_offset'] = section_start
+
+    @property
+    def mp3_filepath(self) -> str:
+        # The first (or only) mp3 that was downloaded.
+        if not self.mp3_filepaths:
+            raise Exception(f"yt-dlp finished without producing an mp3 for {self.yt_url}.")
+        return next(iter(self.mp3_filepaths.values()))
 
     async def yield_progress_updates(self) -> AsyncGenerator[dict, None]:
         while not self.isComplete or not self.yt_progress_updates.empty():
@@ -52,8 +91,9 @@ class YouTubeDownloader:
                 yield {"status": progress_update}
             await asyncio.sleep(1)
 
-    async def download_youtube_to_mp3(self) -> AsyncGenerator[dict, None]:
+    def extract_metadata(self) -> None:
         # YouTube provides some great metadata to use as frontmatter at the top of the Obsidian note.
+        # This is a separate step so the app can decide whether to take the job before downloading anything.
         metadata = MetadataService()
         try:
             metadata.extract_youtube_metadata(youtube_url=self.yt_url,logger=self.logger)
@@ -61,8 +101,7 @@ class YouTubeDownloader:
             self.logger.error(f"Error extracting YouTube metadata: {e}")
             raise Exception(f"Failed to extract YouTube metadata for URL {self.yt_url}: {e}")
 
-
-
+    async def download_youtube_to_mp3(self) -> AsyncGenerator[dict, None]:
         loop = asyncio.get_running_loop()
         download_task = loop.run_in_executor(None, self.download_yt_to_mp3)
         progress_updates = self.yield_progress_updates()
@@ -74,6 +113,7 @@ class YouTubeDownloader:
             pass
 
         await download_task
+        self.assign_chapter_mp3_filepaths()
         yield {"status": "YouTube Download complete."}
 
     def is_youtube_url(request: AudioProcessRequest) -> bool: